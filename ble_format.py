@@ -0,0 +1,28 @@
+import sys
+
+# Shared placeholder for devices that do not advertise a name
+UNKNOWN = sys.intern("Unknown")
+
+
+def format_services(services, indent: str = "", details: bool = True) -> str:
+    """Format GATT services and their characteristics as a single multi-line string.
+
+    Every line is prefixed with indent. With details=True each service is
+    preceded by a blank line and description/descriptor lines are added.
+    """
+    lines = []
+    for service in services:
+        if details:
+            lines.append("")
+        lines.append(f"{indent}Service: {service.uuid}")
+        if details:
+            lines.append(f"{indent}  Description: {service.description}")
+        
+        for char in service.characteristics:
+            lines.append(f"{indent}  Characteristic: {char.uuid} (Properties: {char.properties})")
+            if details:
+                lines.append(f"{indent}    Description: {char.description}")
+                for desc in char.descriptors:
+                    lines.append(f"{indent}    Descriptor: {desc.uuid}")
+                    lines.append(f"{indent}      Description: {desc.description}")
+    return "\n".join(lines)
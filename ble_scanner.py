@@ -1,81 +1,141 @@
 import asyncio
 import argparse
+import json
+import signal
 import sys
+import time
+from collections import deque
+from dataclasses import dataclass
 from bleak import BleakScanner, BleakClient
 
-async def get_device_info(address: str):
+from ble_format import UNKNOWN, format_services
+
+try:
+    import uvloop
+except ImportError:  # optional speedup; uvloop is not available on Windows
+    uvloop = None
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib json module
+    orjson = None
+
+# Placeholder for missing values in the device report
+_NONE_STR = sys.intern("None")
+
+# Number of queued advertisements processed per drain pass during a scan
+ADV_BATCH_SIZE = 16
+
+
+@dataclass(slots=True)
+class DeviceRecord:
+    """Latest advertisement seen for a device during a scan"""
+    device: object
+    rssi: int
+    name: str
+    adv: object
+    adv_sig: int = 0
+
+
+def write_json(payload):
+    """Write payload to stdout as compact JSON, using orjson when available"""
+    if orjson is not None:
+        sys.stdout.buffer.write(orjson.dumps(payload) + b"\n")
+    else:
+        sys.stdout.write(json.dumps(payload, ensure_ascii=False, separators=(',', ':')) + "\n")
+    sys.stdout.flush()
+
+
+def advertisement_signature(advertisement_data) -> int:
+    """Cheap hash of the advertisement payload, used to skip duplicate adverts"""
+    return hash((
+        advertisement_data.local_name,
+        tuple(advertisement_data.service_uuids or ()),
+        tuple(advertisement_data.manufacturer_data.items()) if advertisement_data.manufacturer_data else (),
+        tuple(advertisement_data.service_data.items()) if advertisement_data.service_data else (),
+        advertisement_data.tx_power,
+    ))
+
+
+async def get_device_info(address: str, service_uuids: list[str] | None = None):
     """Get detailed information about a specific BLE device by address"""
     print(f"Getting detailed information for device: {address}")
     
     try:
         # First, try to find the device through scanning
         print("Scanning for device...")
-        device_found = None
         advertisement_info = None
+        # Bleak reports MAC addresses (and CoreBluetooth UUIDs) in upper case,
+        # so normalise the target once instead of on every advertisement.
+        target = address.upper()
         
-        def detection_callback(device, advertisement_data):
-            nonlocal device_found, advertisement_info
-            if device.address.lower() == address.lower():
-                device_found = device
-                advertisement_info = advertisement_data
+        def match_target(device, advertisement_data):
+            nonlocal advertisement_info
+            if device.address != target:
+                return False
+            advertisement_info = advertisement_data
+            return True
         
-        scanner = BleakScanner(detection_callback)
-        await scanner.start()
-        await asyncio.sleep(10)  # Scan for 10 seconds
-        await scanner.stop()
+        # Bleak stops scanning as soon as the filter matches. On BlueZ the
+        # discovery filter also drops adverts from other devices before they
+        # reach Python; other backends ignore the bluez args.
+        device_found = await BleakScanner.find_device_by_filter(
+            match_target,
+            timeout=5.0,
+            service_uuids=service_uuids,
+            bluez={"filters": {"Pattern": target}},
+        )
         
         if not device_found:
             print(f"Device with address {address} not found during scan.")
             return
         
-        print("\n=== BASIC DEVICE INFORMATION ===")
-        print(f"Name: {device_found.name or 'Unknown'}")
-        print(f"Address: {device_found.address}")
-        print(f"Details: {device_found.details}")
-        # print(f"Metadata: {device_found.metadata}")
+        lines = [
+            "\n=== BASIC DEVICE INFORMATION ===",
+            f"Name: {device_found.name or UNKNOWN}",
+            f"Address: {device_found.address}",
+            f"Details: {device_found.details}",
+        ]
+        # lines.append(f"Metadata: {device_found.metadata}")
         
-        print("\n=== ADVERTISEMENT DATA ===")
+        lines.append("\n=== ADVERTISEMENT DATA ===")
         if advertisement_info:
-            print(f"RSSI: {advertisement_info.rssi} dBm")
-            print(f"Local Name: {advertisement_info.local_name or 'Not provided'}")
-            print(f"TX Power: {advertisement_info.tx_power}")
-            print(f"Service UUIDs: {list(advertisement_info.service_uuids) if advertisement_info.service_uuids else 'None'}")
+            _hex = bytes.hex  # bound once for the data loops below
+            lines.append(f"RSSI: {advertisement_info.rssi} dBm")
+            lines.append(f"Local Name: {advertisement_info.local_name or 'Not provided'}")
+            lines.append(f"TX Power: {advertisement_info.tx_power}")
+            lines.append(f"Service UUIDs: {advertisement_info.service_uuids or _NONE_STR}")
             
             if advertisement_info.manufacturer_data:
-                print("Manufacturer Data:")
+                lines.append("Manufacturer Data:")
                 for company_id, data in advertisement_info.manufacturer_data.items():
-                    print(f"  Company ID {company_id}: {data.hex()}")
+                    lines.append(f"  Company ID {company_id}: {_hex(data)}")
             else:
-                print("Manufacturer Data: None")
+                lines.append("Manufacturer Data: None")
             
             if advertisement_info.service_data:
-                print("Service Data:")
+                lines.append("Service Data:")
                 for service_uuid, data in advertisement_info.service_data.items():
-                    print(f"  Service {service_uuid}: {data.hex()}")
+                    lines.append(f"  Service {service_uuid}: {_hex(data)}")
             else:
-                print("Service Data: None")
+                lines.append("Service Data: None")
+        
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
         
         # Try to connect and get services/characteristics
         print(f"\n=== ATTEMPTING CONNECTION ===")
         try:
-            async with BleakClient(address) as client:
+            # Reuse the scanned device so bleak does not scan again to resolve it
+            async with BleakClient(device_found) as client:
                 if client.is_connected:
                     print("✓ Successfully connected!")
                     
-                    print("\n=== SERVICES AND CHARACTERISTICS ===")
-                    
-                    for service in client.services:
-                        print(f"\nService: {service.uuid}")
-                        print(f"  Description: {service.description}")
-                        
-                        for characteristic in service.characteristics:
-                            print(f"  Characteristic: {characteristic.uuid}")
-                            print(f"    Description: {characteristic.description}")
-                            print(f"    Properties: {characteristic.properties}")
-                            
-                            for descriptor in characteristic.descriptors:
-                                print(f"    Descriptor: {descriptor.uuid}")
-                                print(f"      Description: {descriptor.description}")
+                    lines = ["\n=== SERVICES AND CHARACTERISTICS ==="]
+                    if client.services:
+                        lines.append(format_services(client.services))
+                    sys.stdout.write("\n".join(lines) + "\n")
+                    sys.stdout.flush()
                 else:
                     print("✗ Failed to connect")
         
@@ -87,67 +147,149 @@ async def get_device_info(address: str):
         print(f"Error getting device information: {e}")
 
 
-async def scan_ble_devices(scan_time: int = 5, dbm_max: int = -80):
-    """Scan for BLE devices and display basic information"""
-    print(f"Starting BLE scan for {scan_time} seconds...")
-    print(f"Filtering devices with RSSI > {dbm_max} dBm")
+async def scan_ble_devices(scan_time: int = 5, dbm_max: int = -80, service_uuids: list[str] | None = None,
+                           stop_event: asyncio.Event | None = None, as_json: bool = False):
+    """Scan for BLE devices and display basic information; stop_event or Ctrl-C ends the scan early"""
+    # Keep stdout clean for the JSON document when as_json is set
+    log = sys.stderr if as_json else sys.stdout
+    print(f"Starting BLE scan for {scan_time} seconds...", file=log)
+    print(f"Filtering devices with RSSI > {dbm_max} dBm", file=log)
+    if service_uuids:
+        print(f"Filtering devices advertising services: {', '.join(service_uuids)}", file=log)
     
     # Dictionary to store discovered devices with their RSSI
     discovered_devices = {}
+    # Advertisements queued by the scanner callback, drained in batches
+    pending = deque()
+    # Addresses seen at any signal strength, for the "all filtered out" message
+    seen_addresses = set()
+    
     def detection_callback(device, advertisement_data):
         """Callback function to handle detected devices"""
-        discovered_devices[device.address] = {
-            'device': device,
-            'rssi': advertisement_data.rssi,
-            'name': device.name or "Unknown",
-            'advertisement_data': advertisement_data
-        }
-    
-    # Create scanner and start scanning
-    scanner = BleakScanner(detection_callback)
+        seen_addresses.add(device.address)
+        if advertisement_data.rssi <= dbm_max:
+            return
+        pending.append((device, advertisement_data))
+    
+    def record_advertisement(device, advertisement_data):
+        """Store or update the record for an advertising device"""
+        sig = advertisement_signature(advertisement_data)
+        rec = discovered_devices.get(device.address)
+        if rec is None:
+            discovered_devices[device.address] = DeviceRecord(
+                device, advertisement_data.rssi, device.name or UNKNOWN, advertisement_data, sig
+            )
+            return
+        # Repeat advertisement: skip if nothing changed, otherwise update in place
+        if rec.rssi == advertisement_data.rssi and rec.adv_sig == sig:
+            return
+        rec.device = device
+        rec.rssi = advertisement_data.rssi
+        rec.name = device.name or UNKNOWN
+        rec.adv = advertisement_data
+        rec.adv_sig = sig
+    
+    # Create scanner and start scanning (service UUID filtering is done by the OS)
+    scanner = BleakScanner(detection_callback, service_uuids=service_uuids)
+    
+    async def drain():
+        while True:
+            if not pending:
+                await asyncio.sleep(0.05)
+                continue
+            for _ in range(min(ADV_BATCH_SIZE, len(pending))):
+                record_advertisement(*pending.popleft())
+            await asyncio.sleep(0)
+    
+    if stop_event is None:
+        stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    
     await scanner.start()
-    await asyncio.sleep(scan_time)
-    await scanner.stop()
+    drain_task = asyncio.create_task(drain())
+    # SIGINT handler that asyncio.run/uvloop.run installed, restored after the scan
+    prev_sigint = signal.getsignal(signal.SIGINT)
+    sigint_handled = False
+    try:
+        try:
+            loop.add_signal_handler(signal.SIGINT, stop_event.set)
+            sigint_handled = True
+        except (NotImplementedError, RuntimeError):  # e.g. Windows, or not the main thread
+            pass
+        
+        deadline = time.monotonic() + scan_time
+        while not stop_event.is_set() and time.monotonic() < deadline:
+            await asyncio.sleep(0.25)
+    finally:
+        if sigint_handled:
+            loop.remove_signal_handler(signal.SIGINT)
+            if prev_sigint is not None:
+                signal.signal(signal.SIGINT, prev_sigint)
+        await scanner.stop()
+        drain_task.cancel()
+        try:
+            await drain_task
+        except asyncio.CancelledError:
+            pass
     
-    if not discovered_devices:
+    # Process whatever arrived after the last drain pass
+    while pending:
+        record_advertisement(*pending.popleft())
+    
+    if as_json:
+        write_json([
+            {
+                "addr": address,
+                "rssi": info.rssi,
+                "name": info.device.name,  # null when not advertised, unlike the text report
+                "uuids": list(info.adv.service_uuids or ()),
+                "mfr": {str(cid): data.hex() for cid, data in (info.adv.manufacturer_data or {}).items()},
+            }
+            for address, info in discovered_devices.items()
+        ])
+        return
+    
+    if not seen_addresses:
         print("No BLE devices found.")
         return
-    # Filter devices by RSSI
-    filtered_devices = {addr: info for addr, info in discovered_devices.items() if info['rssi'] > dbm_max}
     
-    if not filtered_devices:
-        print(f"No BLE devices found with RSSI > {dbm_max} dBm (found {len(discovered_devices)} total, all filtered out).")
+    if not discovered_devices:
+        print(f"No BLE devices found with RSSI > {dbm_max} dBm (found {len(seen_addresses)} total, all filtered out).")
         return
     
-    print(f"\nFound {len(filtered_devices)} device(s):")
+    print(f"\nFound {len(discovered_devices)} device(s):")
     print("-" * 80)
-    for address, info in filtered_devices.items():
-        device_name = info['name']
-        rssi = info['rssi']
-        ad_data = info['advertisement_data']
+    for address, info in discovered_devices.items():
+        device_name = info.name
+        rssi = info.rssi
+        ad_data = info.adv
         
-        print(f"Name: {device_name}")
-        print(f"Address: {address}")
-        print(f"RSSI: {rssi} dBm")
+        lines = [
+            f"Name: {device_name}",
+            f"Address: {address}",
+            f"RSSI: {rssi} dBm",
+        ]
         
         # Show service UUIDs if available
         if ad_data.service_uuids:
-            print(f"Services: {list(ad_data.service_uuids)}")
+            lines.append(f"Services: {', '.join(ad_data.service_uuids)}")
         
         # Show manufacturer data if available
         if ad_data.manufacturer_data:
             manufacturer_info = []
             for company_id, data in ad_data.manufacturer_data.items():
                 manufacturer_info.append(f"ID:{company_id}")
-            print(f"Manufacturer: {', '.join(manufacturer_info)}")
+            lines.append(f"Manufacturer: {', '.join(manufacturer_info)}")
         
-        print("-" * 40)
+        lines.append("-" * 40)
+        sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
     
     print("Scan complete.")
 
 
-def main():
-    """Main function with command line argument parsing"""
+def _build_parser():
+    """Build the command line argument parser"""
     parser = argparse.ArgumentParser(
         description="BLE Scanner - Scan for BLE devices or get detailed device information",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -156,6 +298,8 @@ Examples:
   python scanner.py                           # Scan for 5 seconds (default)
   python scanner.py --scan-time 10           # Scan for 10 seconds
   python scanner.py --address AA:BB:CC:DD:EE:FF  # Get detailed info for specific device
+  python scanner.py --service-uuid 180d       # Only show devices advertising a service
+  python scanner.py --json                    # Print scan results as JSON
         """
     )
     
@@ -177,21 +321,49 @@ Examples:
         default=-80,
         help='Filter out devices with weak signal strength'
     )
-    
-    args = parser.parse_args()
+    parser.add_argument(
+        '--service-uuid', '-u',
+        action='append',
+        dest='service_uuids',
+        metavar='UUID',
+        help='Only report devices advertising this service UUID (can be given multiple times)'
+    )
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='Print scan results as JSON on stdout (uses orjson if installed); not valid with --address'
+    )
+    return parser
+
+
+# Built once at import time and reused by every main() call
+_PARSER = _build_parser()
+
+
+def main():
+    """Main function with command line argument parsing"""
+    args = _PARSER.parse_args()
+    if args.json and args.address:
+        _PARSER.error("--json is only supported for scans, not with --address")
+    # Keep stdout clean for the JSON document when --json is set
+    log = sys.stderr if args.json else sys.stdout
+    if uvloop is not None and not hasattr(uvloop, "run"):
+        # uvloop < 0.18 has no run(); install its loop policy instead
+        uvloop.install()
+    run = getattr(uvloop, "run", None) or asyncio.run
     
     try:
         if args.address:
             # Get detailed info for specific device
-            asyncio.run(get_device_info(args.address))
+            run(get_device_info(args.address, args.service_uuids))
         else:
             # Scan for devices
-            asyncio.run(scan_ble_devices(args.scan_time, args.dbm_max))
+            run(scan_ble_devices(args.scan_time, args.dbm_max, args.service_uuids, as_json=args.json))
     except KeyboardInterrupt:
-        print("\nScan interrupted by user")
+        print("\nScan interrupted by user", file=log)
         sys.exit(0)
     except Exception as e:
-        print(f"Error: {e}")
+        print(f"Error: {e}", file=log)
         sys.exit(1)
 
 
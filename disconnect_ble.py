@@ -1,12 +1,52 @@
 import asyncio
+import sys
 from bleak import BleakScanner, BleakClient
 
+from ble_format import UNKNOWN, format_services
+
+try:
+    import uvloop
+except ImportError:  # optional speedup; uvloop is not available on Windows
+    uvloop = None
+
+# Maximum number of simultaneous GATT connections to attempt
+MAX_CONCURRENT_CONNECTIONS = 4
+
+
+async def probe_device(device, sem):
+    """
+    Connect to a single device, list its services, and disconnect.
+    Returns the report lines for the device.
+    """
+    lines = [f"Device: {device.name or UNKNOWN} ({device.address})"]
+    
+    async with sem:
+        try:
+            # Connect using the scanned BLEDevice so bleak does not re-scan for it
+            async with BleakClient(device, timeout=5.0) as client:
+                lines.append(f"  ✓ Connected: {client.is_connected}")
+                
+                # List all services
+                lines.append(f"  Services found: {len(client.services)}")
+                if client.services:
+                    lines.append(format_services(client.services, indent="    ", details=False))
+                
+                lines.append(f"  ✓ Disconnected from {device.address}")
+                # The 'async with' block automatically disconnects when exiting
+                
+        except Exception as e:
+            lines.append(f"  ✗ Skipping (device not available or cannot connect): {e}")
+    
+    return lines
+
+
 async def scan_and_disconnect_devices():
     """
     Scan for BLE devices, connect to each, list services, and disconnect.
     """
     print("Scanning for BLE devices...")
-    devices = await BleakScanner.discover(timeout=5.0)
+    results = await BleakScanner.discover(timeout=5.0, return_adv=True)
+    devices = [device for device, _adv in results.values()]
     
     if not devices:
         print("No BLE devices found")
@@ -14,31 +54,26 @@ async def scan_and_disconnect_devices():
     
     print(f"\nFound {len(devices)} device(s):\n")
     
-    for device in devices:
-        print(f"Device: {device.name or 'Unknown'} ({device.address})")
-        
-        try:
-            # Connect to the device
-            async with BleakClient(device.address, timeout=5.0) as client:
-                print(f"  ✓ Connected: {client.is_connected}")
-                
-                # List all services
-                print(f"  Services found: {len(client.services)}")
-                for service in client.services:
-                    print(f"    Service: {service.uuid}")
-                    for char in service.characteristics:
-                        print(f"      Characteristic: {char.uuid} (Properties: {char.properties})")
-                
-                print(f"  ✓ Disconnected from {device.address}")
-                # The 'async with' block automatically disconnects when exiting
-                
-        except Exception as e:
-            print(f"  ✗ Skipping (device not available or cannot connect): {e}")
-        
-        print()  # Empty line between devices
+    # Probe devices concurrently, but cap the number of open connections
+    sem = asyncio.Semaphore(MAX_CONCURRENT_CONNECTIONS)
+    reports = await asyncio.gather(*(probe_device(d, sem) for d in devices), return_exceptions=True)
+    
+    for device, report in zip(devices, reports):
+        if isinstance(report, BaseException):
+            report = [
+                f"Device: {device.name or UNKNOWN} ({device.address})",
+                f"  ✗ Skipping (device not available or cannot connect): {report}",
+            ]
+        # One write per device, with an empty line between devices
+        sys.stdout.write("\n".join(report) + "\n\n")
+    sys.stdout.flush()
 
 def main():
-    asyncio.run(scan_and_disconnect_devices())
+    if uvloop is not None and not hasattr(uvloop, "run"):
+        # uvloop < 0.18 has no run(); install its loop policy instead
+        uvloop.install()
+    run = getattr(uvloop, "run", None) or asyncio.run
+    run(scan_and_disconnect_devices())
 
 if __name__ == "__main__":
     main()